@@ -1,17 +1,16 @@
-import datetime
+import asyncio
 import getpass
-import json
 import os
 import psutil
+import shutil
 import sys
 import subprocess
 import numpy as np
-import pandas as pd
+import qasync
 
 # Debugging
 import time
 
-from packaging import version
 from psutil._common import bytes2human
 from PyQt5.QtCore import Qt, QTimer, QAbstractTableModel, QModelIndex
 from PyQt5.QtWidgets import (
@@ -23,65 +22,215 @@ from PyQt5.QtWidgets import (
     QLineEdit,
     QWidget,
     QTableView,
-    QMessageBox,
     # Layout
     QVBoxLayout,
     QHBoxLayout,
     QHeaderView,
     QAbstractScrollArea,
 )
-from PyQt5.QtGui import QIntValidator
+from PyQt5.QtGui import QIntValidator, QFontMetrics
 
-__debug = True
-SQUEUE_TIMEVAR = [
+# Leading underscore (not two) so methods can read it without name mangling
+_debug = True
+# Hard floor (s) on the polling interval so we do not hammer slurmctld
+SQUEUE_MIN_INTERVAL = 5
+SQUEUE_TIMEVAR = frozenset({
     "accrue_time",
     "eligible_time",
     "end_time",
     "last_sched_evaluation",
     "start_time",
     "submit_time",
-    ]
-
-# Model class for our table
+    })
+# Per-column storage dtypes so the model holds typed arrays instead of
+# boxed Python objects; time columns become datetime64[s], anything not
+# listed falls back to object
+SQUEUE_COLTYPE = {
+    "job_id":     "int64",
+    "job_state":  "U16",
+    "user_name":  "U32",
+    "qos":        "U32",
+    "node_count": "int64",
+    "cpus":       "int64",
+    }
+
+# Model class for our table, holding one typed array per column
 class SqueueGUIModel(QAbstractTableModel):
-    def __init__(self, array, headers, parent=None):
+    def __init__(self, columns, headers, parent=None):
         QAbstractTableModel.__init__(self, parent=parent)
-        self._array    = array
-        self._headers  = headers
-        self.r, self.c = np.shape(array)
-        self._sortby   = 0
-        self._sortord  = Qt.DescendingOrder
+        self._cols    = columns
+        self._display = self._make_display(columns)
+        self._headers = headers
+        self._header_idx = {h: i for i, h in enumerate(headers)}
+        self.r        = len(columns[headers[0]])
+        self.c        = len(headers)
+        self._sortby  = 0
+        self._sortord = Qt.DescendingOrder
+        # Cached sort permutation, reused while the sort key is unchanged
+        self._last_sort_key = None
+        self._last_argsort  = None
 
     @property
-    def array(self):
-        return self._array
+    def columns(self):
+        return self._cols
 
     @property
     def headers(self):
         return self._headers
 
-    def update_model(self, new_array, new_headers):
-        self.layoutAboutToBeChanged.emit()
-
-        old_sortvar    = self.headers[self._sortby]
-        self._array    = new_array
-        self._headers  = new_headers
-        self.r, self.c = np.shape(new_array)
-
-        if old_sortvar not in new_headers:
-            self._sortby = 0
+    def update_model(self, new_cols, new_headers):
+        old_cols    = self._cols
+        old_headers = self._headers
+
+        # new_cols arrives already sorted by the caller; only remap the
+        # sort column onto the headers through the cached index dict,
+        # rebuilt only when the headers actually change
+        old_sortvar = old_headers[self._sortby]
+        if new_headers != old_headers:
+            self._header_idx = {h: i for i, h in enumerate(new_headers)}
+        self._sortby = self._header_idx.get(old_sortvar, 0)
+
+        # Without a stable job_id key (or with new columns) diffing is
+        # meaningless; swap the whole model
+        if old_headers != new_headers or 'job_id' not in self._header_idx:
+            self._reset_model(new_cols, new_headers)
+            return
+
+        # Diff old vs. new rows by job_id so the view only repaints what
+        # actually changed, keeping selection and scroll position intact
+        old_ids   = old_cols['job_id'].tolist()
+        new_ids   = new_cols['job_id'].tolist()
+        old_idset = set(old_ids)
+        new_idset = set(new_ids)
+
+        # Surviving jobs must keep their relative order for the row ranges
+        # below to line up; otherwise fall back to the full swap
+        kept_old = [ji for ji in old_ids if ji in new_idset]
+        kept_new = [ji for ji in new_ids if ji in old_idset]
+        if kept_old != kept_new:
+            self._reset_model(new_cols, new_headers)
+            return
+
+        removed = [i for i, ji in enumerate(old_ids) if ji not in new_idset]
+        added   = [i for i, ji in enumerate(new_ids) if ji not in old_idset]
+
+        new_disp = self._make_display(new_cols)
+
+        work = old_cols
+        for first, last in reversed(self._row_ranges(removed)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            work = {
+                k: np.delete(v, np.s_[first:last + 1])
+                for k, v in work.items()
+                }
+            self._cols    = work
+            self._display = {
+                k: np.delete(v, np.s_[first:last + 1])
+                for k, v in self._display.items()
+                }
+            self.r = len(work[new_headers[0]])
+            self.endRemoveRows()
+
+        for first, last in self._row_ranges(added):
+            self.beginInsertRows(QModelIndex(), first, last)
+            work = {
+                k: np.insert(v, first, new_cols[k][first:last + 1])
+                for k, v in work.items()
+                }
+            self._cols    = work
+            self._display = {
+                k: np.insert(v, first, new_disp[k][first:last + 1])
+                for k, v in self._display.items()
+                }
+            self.r = len(work[new_headers[0]])
+            self.endInsertRows()
+
+        # Rows now line up one-to-one; repaint only the ones whose values
+        # moved under them
+        self._cols    = new_cols
+        self._display = new_disp
+        if self.r:
+            changed_mask = np.zeros(self.r, dtype=bool)
+            for k in new_headers:
+                diff = work[k] != new_cols[k]
+                if work[k].dtype.kind == 'M':
+                    # NaT never compares equal to itself
+                    diff &= ~(np.isnat(work[k]) & np.isnat(new_cols[k]))
+                changed_mask |= diff
+            changed = np.flatnonzero(changed_mask)
+            if len(changed):
+                self.dataChanged.emit(
+                    self.index(changed[0], 0),
+                    self.index(changed[-1], self.c - 1),
+                    )
+
+    def _reset_model(self, new_cols, new_headers):
+        # A full swap invalidates every index anyway; a model reset is far
+        # cheaper than the persistent-index remapping layoutChanged does
+        self.beginResetModel()
+        self._cols    = new_cols
+        self._display = self._make_display(new_cols)
+        self._headers = new_headers
+        self.r        = len(new_cols[new_headers[0]])
+        self.c        = len(new_headers)
+        self.endResetModel()
+
+    @staticmethod
+    def _make_display(cols):
+        # Preformat datetime64 columns so data() is a plain array lookup
+        # instead of per-cell strftime work on every repaint
+        display = {}
+        for k, v in cols.items():
+            if v.dtype.kind == 'M':
+                display[k] = np.where(
+                    np.isnat(v),
+                    'N/A',
+                    np.datetime_as_string(v, unit='s'),
+                    )
+        return display
+
+    def _sorted_cols(self, cols, headers, column, order):
+        key = cols[headers[column]]
+        ids = cols.get('job_id')
+
+        # Identical sort key and job_ids mean the permutation cannot have
+        # changed; skip the argsort, which is at its slowest on the
+        # already-sorted data the steady state produces
+        cache_key = (
+            column,
+            int(order),
+            key.tobytes(),
+            ids.tobytes() if ids is not None else None,
+            )
+        if cache_key == self._last_sort_key:
+            argsort = self._last_argsort
         else:
-            self._sortby = new_headers.index(old_sortvar)
-        
-        # Resort the new array
-        column = self._sortby
-        order  = self._sortord
-        argsort = self.array[:, column].argsort()
-        if order == Qt.AscendingOrder:
-            argsort = argsort[::-1]
-        self._array = self.array[argsort]
-
-        self.layoutChanged.emit()
+            # Stable sort with job_id as tiebreaker so equal keys keep a
+            # deterministic order across refreshes
+            if ids is not None:
+                argsort = np.lexsort((ids, key))
+            else:
+                argsort = np.argsort(key, kind='stable')
+            if order == Qt.DescendingOrder:
+                argsort = argsort[::-1]
+            self._last_sort_key = cache_key
+            self._last_argsort  = argsort
+
+        # Fresh contiguous arrays so later passes stay cache-friendly
+        return {
+            k: np.ascontiguousarray(v[argsort]) for k, v in cols.items()
+            }
+
+    @staticmethod
+    def _row_ranges(rows):
+        # Group sorted row indices into contiguous [first, last] ranges
+        ranges = []
+        for i in rows:
+            if ranges and i == ranges[-1][1] + 1:
+                ranges[-1][1] = i
+            else:
+                ranges.append([i, i])
+        return ranges
 
     def rowCount(self, parent=QModelIndex()):
         return self.r
@@ -108,13 +257,16 @@ class SqueueGUIModel(QAbstractTableModel):
         if column < 0 or column >= self.columnCount():
             return None
         if role == Qt.DisplayRole:
-            value = self.array[row, column]
+            header = self._headers[column]
+
+            # Time columns are preformatted once per refresh
+            if header in self._display:
+                return self._display[header][row].item()
 
-            if isinstance(value, datetime.date):
-                if (int(value.strftime('%s')) == 18000):
-                    return 'N/A'
-                else:
-                    return value.isoformat()
+            value = self._cols[header][row]
+            if isinstance(value, np.generic):
+                # Hand Qt a plain Python scalar
+                return value.item()
 
             return value
         return None
@@ -130,41 +282,59 @@ class SqueueGUIModel(QAbstractTableModel):
             return False
         if column < 0 or column >= self.columnCount():
             return False
-        self.array.values[row][column] = value
-        self.dataChanged.emit(index, index)
+        header = self._headers[column]
+        self._cols[header][row] = value
+        # Keep the preformatted strings and the cached sort permutation in
+        # step with the edited column
+        if header in self._display:
+            self._display[header] = self._make_display(
+                {header: self._cols[header]}
+                )[header]
+        self._last_sort_key = None
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
         return True
 
     def sort(self, column, order):
-        self.layoutAboutToBeChanged.emit()
+        # Sorting permutes every row, so a reset beats remapping all the
+        # persistent indexes through layoutChanged
+        self.beginResetModel()
         self._sortby  = column
         self._sortord = order
-        argsort = self.array[:, column].argsort()
-        if order == Qt.AscendingOrder:
-            argsort = argsort[::-1]
-        self._array = self.array[argsort]
-        self.layoutChanged.emit()
+        self._cols    = self._sorted_cols(
+            self._cols, self._headers, column, order,
+            )
+        self._display = self._make_display(self._cols)
+        self.endResetModel()
 
 # Main window widget
 class SQGUIMainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
-        # Check squeue main version should support squeue --json
+        # Resolve the squeue binary once so every refresh skips the PATH
+        # walk; on Linux also skip the FD-closing loop in the child
+        self.sqbin = shutil.which('squeue') or 'squeue'
+
+        # Read the slurm version for the window title
         self.sqver = subprocess.run(
-            ['squeue', '--version'],
+            [self.sqbin, '--version'],
             stdout=subprocess.PIPE,
             check=True,
+            close_fds=(sys.platform != 'linux'),
             ).stdout.decode('utf-8').strip().split(" ", 2)[1]
-        if version.parse(self.sqver) < version.parse("21.08"):
-            self.version_error()
-        
+
         # Set window's title
         self.setWindowTitle("squeue-gui (slurm ver. {})".format(self.sqver))
         
         # Get the user name
         self.uname = getpass.getuser()
 
-        # Set the columns
+        # Cache the psutil handle for the debug log; keep the last sampled
+        # memory figure between samples
+        self.psproc  = psutil.Process(os.getpid())
+        self.lastmem = 'n/a'
+
+        # Set the columns and the matching squeue -o format fields
         self.sqcols = [
             "job_id",
             "job_state",
@@ -174,11 +344,11 @@ class SQGUIMainWindow(QMainWindow):
             "cpus",
             "start_time",
             ]
+        self.sqofmt = "%A|%T|%u|%q|%D|%C|%S"
 
         # Initialize the model
-        self.sqdata  = pd.DataFrame(columns=self.sqcols)
         self.sqmodel = SqueueGUIModel(
-            np.array(self.sqdata.values),
+            self._build_columns([]),
             self.sqcols,
             )
         
@@ -195,27 +365,64 @@ class SQGUIMainWindow(QMainWindow):
         self.w_sqtable.horizontalHeader().setStretchLastSection(True)
         self.w_sqtable.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
 
+        # Fixed, uniform row heights so Qt never asks the delegate (and
+        # through it data()) for per-row size hints while painting
+        self.w_sqtable.verticalHeader().setSectionResizeMode(
+            QHeaderView.Fixed
+            )
+        self.w_sqtable.verticalHeader().setDefaultSectionSize(
+            QFontMetrics(self.w_sqtable.font()).height() + 4
+            )
+
+        # Column widths are fitted on the first refresh only
+        self.colsized = False
+
+        # Minimum polling interval (s), overridable via the environment but
+        # never below the hard floor
+        try:
+            self.minrte = int(os.environ['SQUEUE_GUI_MIN_INTERVAL'])
+        except (KeyError, ValueError):
+            self.minrte = SQUEUE_MIN_INTERVAL
+        if self.minrte < SQUEUE_MIN_INTERVAL:
+            print('SQUEUE_GUI_MIN_INTERVAL below floor, using {} s'.format(
+                SQUEUE_MIN_INTERVAL
+                ))
+            self.minrte = SQUEUE_MIN_INTERVAL
+
         # Autorefresh timer
         self.arefcnt = 0
-        self.arefrte = 1000
+        self.arefrte = self.minrte * 1000
         self.areftmr = QTimer()
-        self.areftmr.timeout.connect(self.refresh)
+        self.areftmr.timeout.connect(
+            lambda: asyncio.ensure_future(self.refresh())
+            )
+
+        # Lock so overlapping refreshes queue up instead of racing
+        self.areflck = asyncio.Lock()
 
         # Initialize the widgets
         self.w_refresh = QPushButton("Refresh")
         self.w_refresh.setFixedWidth(170)
-        self.w_refresh.clicked.connect(self.refresh)
+        self.w_refresh.clicked.connect(
+            lambda: asyncio.ensure_future(self.refresh())
+            )
         
         self.w_arefbut = QCheckBox("Auto refresh (s)")
         self.w_arefbut.setFixedWidth(120)
         self.w_arefrte = QLineEdit()
         self.w_arefrte.setFixedWidth(40)
-        self.w_arefrte.setValidator(QIntValidator(1, 9999))
-        self.w_arefrte.setText(str(1))
+        self.w_arefrte.setValidator(QIntValidator(self.minrte, 9999))
+        self.w_arefrte.setText(str(self.minrte))
         
         self.w_selffil = QCheckBox("Limit to self job")
         self.w_selffil.setFixedWidth(160)
 
+        self.w_fitcols = QPushButton("Fit columns")
+        self.w_fitcols.setFixedWidth(170)
+        self.w_fitcols.clicked.connect(
+            self.w_sqtable.resizeColumnsToContents
+            )
+
         # Connect the widgets
         self.w_arefrte.textChanged.connect(self.change_autorefresh_rate)
         self.w_arefbut.stateChanged.connect(self.toggle_autorefresh)
@@ -232,6 +439,7 @@ class SQGUIMainWindow(QMainWindow):
         self.l_rghtpnl.addWidget(self.w_refresh)
         self.l_rghtpnl.addLayout(self.l_autoref)
         self.l_rghtpnl.addWidget(self.w_selffil)
+        self.l_rghtpnl.addWidget(self.w_fitcols)
         self.l_rghtpnl.addStretch()
                 
         self.layout.addWidget(self.w_sqtable)        
@@ -241,20 +449,6 @@ class SQGUIMainWindow(QMainWindow):
         widget.setLayout(self.layout)
         self.setCentralWidget(widget)
 
-    # Exit the program if slurm version is not high enough
-    def version_error(self):
-        dlg = QMessageBox(self)
-        dlg.setWindowTitle("Error")
-        dlg.setText(
-            "slurm version {} (< 21.08) does not support JSON output".format(
-                self.sqver
-                )
-            )
-        button = dlg.exec()
-
-        if button == QMessageBox.Ok:
-            sys.exit(1)
-    
     # Toggle the auto-refresh:
     def toggle_autorefresh(self):
         if self.w_arefbut.isChecked():
@@ -270,63 +464,109 @@ class SQGUIMainWindow(QMainWindow):
         try:
             inew_rate = int(new_rate)
             assert inew_rate > 0 and inew_rate < 10000
+            if inew_rate < self.minrte:
+                print('Requested rate below {} s floor, clamping'.format(
+                    self.minrte
+                    ))
+                inew_rate = self.minrte
             self.arefrte = inew_rate * 1000
             self.areftmr.setInterval(self.arefrte)
             print('New auto-refresh rate: {} ms'.format(self.arefrte))
         except:
             print('New auto-refresh rate is invalid')
-            self.w_arefrte.setText(str(1))        
+            self.w_arefrte.setText(str(self.minrte))
 
-    # Refresh function
-    def refresh(self):
+    # Build the typed per-column arrays for the model from the parsed rows
+    def _build_columns(self, rows):
+        cols = {}
+        for i, col in enumerate(self.sqcols):
+            values = [row[i] for row in rows]
+            if col in SQUEUE_TIMEVAR:
+                # squeue prints ISO timestamps, with N/A for unset times
+                cols[col] = np.array(
+                    ['NaT' if v == 'N/A' else v for v in values],
+                    dtype='datetime64[s]',
+                    )
+            else:
+                cols[col] = np.array(
+                    values, dtype=SQUEUE_COLTYPE.get(col, object),
+                    )
+        return cols
+
+    # Refresh function, run as a coroutine so squeue does not block the UI.
+    # A refresh already in flight means squeue is still busy; skip instead
+    # of queueing so requests cannot pile up on the controller.
+    async def refresh(self):
+        if self.areflck.locked():
+            return
+        async with self.areflck:
+            await self._refresh()
+
+    async def _refresh(self):
         self.arefcnt = self.arefcnt + 1
 
         start  = time.time()
-        
-        # Fetch squeue JSON
-        self.sqdata = pd.DataFrame.from_dict(json.loads(
-            subprocess.run(
-                ['squeue', '--json'],
-                stdout=subprocess.PIPE,
-                check=True,
-                ).stdout.decode('utf-8').strip()
-            )['jobs'])
-        
-        # Filter the columns
-        self.sqdata = self.sqdata[self.sqcols]
 
-        # Filter for running or pending job only
-        self.sqdata = self.sqdata[
-            self.sqdata["job_state"].isin(['RUNNING', 'PENDING'])
-            ]
-        
-        # Filter for own job only if needed:
+        # Ask squeue for just the columns we show, pipe-delimited and
+        # already filtered server-side -- a fraction of the --json payload
+        # for both slurmctld and us, without blocking the Qt event loop
+        args = [self.sqbin, '-h', '-o', self.sqofmt,
+                '--states=RUNNING,PENDING']
         if self.w_selffil.isChecked():
-            self.sqdata = self.sqdata[self.sqdata["user_name"] == self.uname]
+            args += ['-u', self.uname]
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            )
+        out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            print('squeue exited with code {}'.format(proc.returncode))
+            return
+        # Split the raw bytes and decode per line instead of materializing
+        # one big decoded copy of the whole payload
+        rows = [
+            line.decode('utf-8').split('|') for line in out.splitlines()
+            ]
 
-        # Convert the datetime variables
-        for col in self.sqcols:
-            if col in SQUEUE_TIMEVAR:
-                self.sqdata[col] = pd.to_datetime(self.sqdata[col],unit='s')
-        
-        # Update the model
-        self.sqmodel.update_model(
-            np.array(self.sqdata.values),
+        # Build one typed array per column and presort the way the view is
+        # currently sorted
+        cols = self.sqmodel._sorted_cols(
+            self._build_columns(rows),
             self.sqcols,
+            self.sqmodel._sortby,
+            self.sqmodel._sortord,
             )
-        self.w_sqtable.resizeColumnsToContents()
 
-        print('Ref {:4d}, rate {}, dur {:.4f} ms, mem {}'.format(
-            self.arefcnt,
-            self.arefrte, 
-            time.time() - start,
-            bytes2human((psutil.Process(os.getpid())).memory_info().rss),
-            ))
+        # Update the model
+        self.sqmodel.update_model(cols, self.sqcols)
+
+        # Fit the column widths once on the first refresh; after that the
+        # Interactive resize mode (plus the Fit columns button) rules, so
+        # we skip an O(rows x cols) sizeHint walk per refresh
+        if not self.colsized:
+            self.w_sqtable.resizeColumnsToContents()
+            self.colsized = True
+
+        if _debug:
+            # Sample RSS only every tenth refresh; it costs /proc reads
+            if self.arefcnt % 10 == 1:
+                self.lastmem = bytes2human(self.psproc.memory_info().rss)
+            print('Ref {:4d}, rate {}, dur {:.4f} ms, mem {}'.format(
+                self.arefcnt,
+                self.arefrte,
+                time.time() - start,
+                self.lastmem,
+                ))
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    w   = SQGUIMainWindow()
+    app  = QApplication(sys.argv)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+
+    w = SQGUIMainWindow()
     w.show()
-    
-    sys.exit(app.exec_())
\ No newline at end of file
+
+    with loop:
+        loop.run_forever()
\ No newline at end of file